@@ -0,0 +1,530 @@
+"""
+Materialized serving table of master programs.
+
+Program listings join masters -> universities -> cities for every request.
+This stage builds a single denormalized table with university and city
+columns copied into each program row. The table is kept in a SQLite file
+with typed columns and program id as primary key, so a listing is a single
+keyed lookup, and university_id and city_id are indexed.
+
+Sources the table was built from are kept next to it. When only some source
+tables change, only the affected rows are updated in place: a changed city
+updates city columns of programs in that city, a changed university updates
+university and city columns of its programs, and changed programs are
+deleted and inserted again. Unchanged source files are not read.
+
+usage:
+
+    python build-serving-table.py
+    python build-serving-table.py --full
+
+author: @firattamur
+"""
+
+
+import os
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import pandas as pd
+
+
+# folder path
+PATH         = "../data-version2/final/"
+SERVING_PATH = "../data-version2/serving/"
+
+# every table has an integer id column as primary key
+PRIMARY_KEY = "id"
+
+# source tables in the order they are joined
+SOURCES = ["masters", "universities", "cities"]
+
+# columns copied from universities and their names in serving table
+UNIVERSITY_COLUMNS = {
+
+    "name"  : "university_name",
+    "image" : "university_image",
+    "rank"  : "university_rank",
+    "cityId": "city_id",
+
+}
+
+# columns copied from cities and their names in serving table
+CITY_COLUMNS = {
+
+    "name"                          : "city_name",
+    "country"                       : "country",
+    "quality_of_life_index"         : "quality_of_life_index",
+    "purchasing_power_index"        : "purchasing_power_index",
+    "safety_index"                  : "safety_index",
+    "health_care_index"             : "health_care_index",
+    "cost_of_living_index"          : "cost_of_living_index",
+    "property_price_to_income_ratio": "property_price_to_income_ratio",
+    "traffic_commute_time_index"    : "traffic_commute_time_index",
+    "pollution_index"               : "pollution_index",
+    "climate_index"                 : "climate_index",
+
+}
+
+# types of serving table columns, masters columns not listed here are text
+# tuition is kept in its currency with decimals, tuition in USD is rounded
+SERVING_TYPES = {
+
+    "id"                            : "Int64",
+    "mode"                          : "category",
+    "schedule"                      : "category",
+    "field"                         : "category",
+    "language"                      : "category",
+    "tution_currency"               : "category",
+    "university_id"                 : "Int64",
+    "duration"                      : "Int64",
+    "tution_amount"                 : "float64",
+    "tution_amount_usd"             : "Int64",
+    "annual_tution_usd"             : "Int64",
+    "university_rank"               : "Int64",
+    "city_id"                       : "Int64",
+    "country"                       : "category",
+    "quality_of_life_index"         : "float64",
+    "purchasing_power_index"        : "float64",
+    "safety_index"                  : "float64",
+    "health_care_index"             : "float64",
+    "cost_of_living_index"          : "float64",
+    "property_price_to_income_ratio": "float64",
+    "traffic_commute_time_index"    : "float64",
+    "pollution_index"               : "float64",
+    "climate_index"                 : "float64",
+
+}
+
+# sqlite column types of serving types, other columns are text
+SQL_TYPES = {
+
+    "Int64"  : "INTEGER",
+    "float64": "REAL",
+
+}
+
+# name of serving table in the database
+TABLE = "programs"
+
+
+def _read_table(path: str, table: str) -> pd.DataFrame:
+    """
+
+    Read a source table as strings indexed by id, empty cells and NULL are missing values.
+
+    :param path : folder of the table
+    :param table: name of the table
+
+    :return     : dataframe indexed by integer id
+
+    """
+
+    frame = pd.read_csv(f"{path}{table}.csv", dtype=str, keep_default_na=False, na_values=["", "NULL"])
+
+    frame.index = pd.to_numeric(frame[PRIMARY_KEY]).astype(int)
+
+    return frame.drop(columns=[PRIMARY_KEY])
+
+
+def _file_hash(path: str) -> str:
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _lookup(part: pd.DataFrame, keys: pd.Series) -> pd.DataFrame:
+    """
+
+    Rows of part for each key, missing or unknown keys give missing values.
+
+    Keys are looked up as floats, a nullable integer key with missing values
+    cannot be joined on an integer index with older pandas.
+
+    :param part: dataframe indexed by integer id
+    :param keys: column of ids like '12' or '12.0'
+
+    :return    : rows of part aligned with keys
+
+    """
+
+    values = part.reindex(pd.to_numeric(keys, errors="coerce").to_numpy(dtype=float))
+
+    values.index = keys.index
+
+    return values
+
+
+def _university_part(universities: pd.DataFrame, cities: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    University and city columns of serving table indexed by university id.
+
+    """
+
+    part = universities[list(UNIVERSITY_COLUMNS.keys())].rename(columns=UNIVERSITY_COLUMNS)
+
+    return part.join(_city_part(cities).pipe(_lookup, part["city_id"]))
+
+
+def _city_part(cities: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    City columns of serving table indexed by city id.
+
+    """
+
+    return cities[list(CITY_COLUMNS.keys())].rename(columns=CITY_COLUMNS)
+
+
+def _with_types(serving: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    Convert columns of serving table to their types and sort rows by id.
+
+    :param serving: serving table
+
+    :return       : typed serving table indexed and sorted by id
+
+    """
+
+    for column, column_type in SERVING_TYPES.items():
+
+        if column not in serving.columns:
+            continue
+
+        if column_type == "category":
+            serving[column] = serving[column].astype("category")
+        else:
+            serving[column] = pd.to_numeric(serving[column], errors="coerce").astype(column_type)
+
+    serving.index.name = PRIMARY_KEY
+
+    return serving.sort_index()
+
+
+def build(masters: pd.DataFrame, universities: pd.DataFrame, cities: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    Join masters with their university and city.
+
+    :param masters     : masters indexed by id
+    :param universities: universities indexed by id
+    :param cities      : cities indexed by id
+
+    :return            : serving table indexed by program id
+
+    """
+
+    # universities are hashed by id, city columns are joined to them once
+    serving = masters.join(_lookup(_university_part(universities, cities), masters["university_id"]))
+
+    return _with_types(serving)
+
+
+def _records(frame: pd.DataFrame) -> list:
+    """
+
+    Rows of a dataframe as tuples of python values, missing values are None.
+
+    """
+
+    values = frame.astype(object)
+
+    return list(values.where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def _changed_ids(old: pd.DataFrame, new: pd.DataFrame) -> pd.Index:
+    """
+
+    Ids of rows inserted, deleted or changed between two versions of a table.
+
+    :param old: previous version indexed by id
+    :param new: current version indexed by id
+
+    :return   : index of changed ids
+
+    """
+
+    if list(old.columns) != list(new.columns):
+        return old.index.union(new.index)
+
+    old_hashes = pd.util.hash_pandas_object(old, index=False)
+    new_hashes = pd.util.hash_pandas_object(new, index=False)
+
+    common = old.index.intersection(new.index)
+
+    changed = common[old_hashes.loc[common].to_numpy() != new_hashes.loc[common].to_numpy()]
+
+    return changed.union(old.index.symmetric_difference(new.index))
+
+
+def connect(serving_path: str = SERVING_PATH, database_name: str = "programs") -> sqlite3.Connection:
+    """
+
+    Open the serving database.
+
+    :param serving_path : folder of serving table
+    :param database_name: name of serving table .sqlite file
+
+    :return             : connection
+
+    """
+
+    return sqlite3.connect(f"{serving_path}{database_name}.sqlite")
+
+
+def _create_table(connection: sqlite3.Connection, serving: pd.DataFrame) -> None:
+    """
+
+    Create typed serving table with program id as primary key and insert all rows.
+
+    :param connection: connection to an empty database
+    :param serving   : serving table indexed by program id
+
+    :return          : None
+
+    """
+
+    columns = [f'"{PRIMARY_KEY}" INTEGER PRIMARY KEY']
+
+    for column in serving.columns:
+        columns.append(f'"{column}" {SQL_TYPES.get(SERVING_TYPES.get(column), "TEXT")}')
+
+    with connection:
+
+        connection.execute(f'CREATE TABLE "{TABLE}" ({", ".join(columns)})')
+
+        _insert(connection, serving)
+
+        connection.execute(f'CREATE INDEX "{TABLE}_university_id" ON "{TABLE}" ("university_id")')
+        connection.execute(f'CREATE INDEX "{TABLE}_city_id" ON "{TABLE}" ("city_id")')
+
+
+def _insert(connection: sqlite3.Connection, serving: pd.DataFrame) -> None:
+
+    columns = ", ".join(f'"{column}"' for column in [PRIMARY_KEY] + list(serving.columns))
+    values  = ", ".join(["?"] * (len(serving.columns) + 1))
+
+    connection.executemany(f'INSERT INTO "{TABLE}" ({columns}) VALUES ({values})', _records(serving.reset_index()))
+
+
+def _update(connection: sqlite3.Connection, part: pd.DataFrame, key: str) -> int:
+    """
+
+    Update columns of a joined part for all programs holding its ids.
+
+    :param connection: connection to serving database
+    :param part      : university or city part indexed by its id, missing values for deleted ids
+    :param key       : indexed column of serving table holding id of part
+
+    :return          : number of updated programs
+
+    """
+
+    assignments = ", ".join(f'"{column}" = ?' for column in part.columns)
+
+    # key is the last parameter of each update
+    rows = [values + (key_id,) for values, key_id in zip(_records(part), part.index.tolist())]
+
+    cursor = connection.executemany(f'UPDATE "{TABLE}" SET {assignments} WHERE "{key}" = ?', rows)
+
+    return cursor.rowcount
+
+
+def refresh(connection: sqlite3.Connection, old: dict, new: dict, verbose: bool = False) -> None:
+    """
+
+    Update only rows of serving table affected by changed sources, in one transaction.
+
+    :param connection: connection to serving database
+    :param old       : dict of source name and previous version, None for unchanged sources
+    :param new       : dict of source name and function reading current version
+    :param verbose   : print updated rows
+
+    :return          : None
+
+    """
+
+    with connection:
+
+        # rebuild changed programs
+        if old["masters"] is not None:
+
+            changed = _changed_ids(old["masters"], new["masters"]())
+
+            connection.executemany(f'DELETE FROM "{TABLE}" WHERE "{PRIMARY_KEY}" = ?', [(program_id,) for program_id in changed.tolist()])
+
+            masters = new["masters"]()
+            rebuilt = build(masters.loc[masters.index.intersection(changed)], new["universities"](), new["cities"]())
+
+            _insert(connection, rebuilt)
+
+            if verbose:
+                print(f"masters - Rebuilt rows: {len(rebuilt)}")
+
+        # university columns, city id may change too so city columns follow
+        if old["universities"] is not None:
+
+            changed = _changed_ids(old["universities"], new["universities"]())
+
+            part = _university_part(new["universities"](), new["cities"]()).reindex(changed)
+
+            count = _update(connection, _with_types(part), "university_id")
+
+            if verbose:
+                print(f"universities - Updated rows: {count}")
+
+        # city columns
+        if old["cities"] is not None:
+
+            changed = _changed_ids(old["cities"], new["cities"]())
+
+            part = _city_part(new["cities"]()).reindex(changed)
+
+            count = _update(connection, _with_types(part), "city_id")
+
+            if verbose:
+                print(f"cities - Updated rows: {count}")
+
+
+def load_serving_table(serving_path: str = SERVING_PATH, database_name: str = "programs") -> pd.DataFrame:
+    """
+
+    Read whole serving table with its column types, indexed by program id.
+
+    :param serving_path : folder of serving table
+    :param database_name: name of serving table .sqlite file
+
+    :return             : serving table
+
+    """
+
+    connection = connect(serving_path, database_name)
+
+    try:
+        serving = pd.read_sql_query(f'SELECT * FROM "{TABLE}"', connection, index_col=PRIMARY_KEY)
+    finally:
+        connection.close()
+
+    return _with_types(serving)
+
+
+def lookup_programs(connection: sqlite3.Connection, ids: list) -> pd.DataFrame:
+    """
+
+    Read programs by id from serving table, each id is a primary key lookup.
+
+    :param connection: connection to serving database
+    :param ids       : program ids
+
+    :return          : typed rows of serving table indexed by program id, unknown ids are skipped
+
+    """
+
+    placeholders = ", ".join(["?"] * len(ids))
+
+    serving = pd.read_sql_query(
+        f'SELECT * FROM "{TABLE}" WHERE "{PRIMARY_KEY}" IN ({placeholders})', connection,
+        params=[int(program_id) for program_id in ids], index_col=PRIMARY_KEY
+    )
+
+    return _with_types(serving)
+
+
+def build_serving_table(path: str = PATH, serving_path: str = SERVING_PATH, database_name: str = "programs", full: bool = False, verbose: bool = True) -> None:
+    """
+
+    Build serving table from final tables, or refresh it if it was built before.
+
+    :param path         : folder of final tables
+    :param serving_path : folder of serving table and its sources
+    :param database_name: name of serving table .sqlite file
+    :param full         : rebuild whole table even if it was built before
+    :param verbose      : print updated rows
+
+    :return             : None
+
+    """
+
+    sources_path  = f"{serving_path}sources/"
+    database_path = f"{serving_path}{database_name}.sqlite"
+
+    os.makedirs(sources_path, exist_ok=True)
+
+    is_built = os.path.exists(database_path) and all(os.path.exists(f"{sources_path}{source}.csv") for source in SOURCES)
+
+    old : dict = dict()
+
+    if is_built and not full:
+
+        # unchanged source files are not read
+        for source in SOURCES:
+
+            if _file_hash(f"{path}{source}.csv") == _file_hash(f"{sources_path}{source}.csv"):
+                old[source] = None
+            else:
+                old[source] = _read_table(sources_path, source)
+
+        # new columns of masters need a new table
+        if old["masters"] is not None and list(old["masters"].columns) != list(_read_table(path, "masters").columns):
+            full = True
+
+    if full or not is_built:
+
+        serving = build(*(_read_table(path, source) for source in SOURCES))
+
+        # readers keep the old table until the new one is complete
+        temporary = f"{database_path}.tmp"
+
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+        connection = sqlite3.connect(temporary)
+        _create_table(connection, serving)
+        connection.close()
+
+        os.replace(temporary, database_path)
+
+        if verbose:
+            print(f"Built rows: {len(serving)}")
+
+    else:
+
+        # current versions are read once and only if needed
+        current : dict = dict()
+
+        def reader(source: str):
+
+            def read() -> pd.DataFrame:
+
+                if source not in current:
+                    current[source] = _read_table(path, source)
+
+                return current[source]
+
+            return read
+
+        connection = connect(serving_path, database_name)
+
+        try:
+            refresh(connection, old, {source: reader(source) for source in SOURCES}, verbose)
+        finally:
+            connection.close()
+
+    # keep sources the table was built from for the next refresh
+    for source in SOURCES:
+        shutil.copyfile(f"{path}{source}.csv", f"{sources_path}{source}.csv")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build denormalized serving table of master programs.")
+
+    parser.add_argument("--full", action="store_true", help="rebuild whole table")
+
+    args = parser.parse_args()
+
+    # start building
+    build_serving_table(full=args.full)
@@ -0,0 +1,301 @@
+"""
+Mirror university logos into a local content addressed cache.
+
+universities.image points to logos on a third party CDN and many
+universities share the same logo. This stage downloads logos concurrently,
+stores each distinct logo once under the hash of its content together with
+resized thumbnails, and rewrites universities.image to the local asset.
+
+Downloaded urls are kept in a manifest, so only new urls are downloaded on
+the next run. Logos which cannot be downloaded keep their original url.
+
+usage:
+
+    python mirror-university-logos.py --workers 16
+    python mirror-university-logos.py --asset-url http://localhost:8000/logos/
+
+author: @firattamur
+"""
+
+
+import io
+import os
+import csv
+import hashlib
+import argparse
+import threading
+import requests
+import pandas as pd
+from tqdm import tqdm
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# folder path
+PATH       = "../data-version2/final/"
+CACHE_PATH = "../data-version2/assets/logos/"
+
+# prefix of rewritten image urls, cache folder is served under it
+ASSET_URL = "/assets/logos/"
+
+# longest side of thumbnails in pixels
+THUMBNAIL_SIZES = [64, 128]
+
+# number of concurrent downloads
+WORKERS = 16
+
+# seconds to wait for a logo
+TIMEOUT = 10
+
+# columns of manifest
+MANIFEST_COLUMNS = ["url", "hash", "extension"]
+
+# file extensions of image formats
+EXTENSIONS = {
+
+    "PNG" : "png",
+    "JPEG": "jpg",
+    "GIF" : "gif",
+    "WEBP": "webp",
+    "BMP" : "bmp",
+    "ICO" : "ico",
+
+}
+
+# a session for each download thread, sessions keep connections to the CDN open
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+
+    return _local.session
+
+
+def _asset_path(digest: str, extension: str) -> str:
+    """
+
+    Path of a logo relative to the cache folder, first two characters of hash are the folder.
+
+    :param digest   : sha256 of logo content
+    :param extension: file extension of logo
+
+    :return         : relative path
+
+    """
+
+    return f"{digest[:2]}/{digest}.{extension}"
+
+
+def _write(path: str, content: bytes) -> None:
+    """
+
+    Write file atomically, a file with the same hash never changes so existing files are kept.
+
+    """
+
+    if os.path.exists(path):
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temporary = f"{path}.{threading.get_ident()}.tmp"
+
+    with open(temporary, 'wb') as f:
+        f.write(content)
+
+    os.replace(temporary, path)
+
+
+def store_logo(content: bytes, cache_path: str = CACHE_PATH) -> tuple:
+    """
+
+    Store logo and its thumbnails in cache under hash of its content.
+
+    :param content   : raw content of logo
+    :param cache_path: folder of cache
+
+    :return          : hash and file extension of logo
+
+    :raises OSError  : if content is not an image
+
+    """
+
+    digest = hashlib.sha256(content).hexdigest()
+
+    image = Image.open(io.BytesIO(content))
+
+    extension = EXTENSIONS.get(image.format, "img")
+
+    _write(os.path.join(cache_path, _asset_path(digest, extension)), content)
+
+    for size in THUMBNAIL_SIZES:
+
+        thumbnail_path = os.path.join(cache_path, f"{digest[:2]}/{digest}-{size}.png")
+
+        if os.path.exists(thumbnail_path):
+            continue
+
+        thumbnail = image.convert("RGBA")
+        thumbnail.thumbnail((size, size))
+
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format="PNG", optimize=True)
+
+        _write(thumbnail_path, buffer.getvalue())
+
+    return digest, extension
+
+
+def _mirror_single_logo(url: str, cache_path: str) -> tuple:
+    """
+
+    Download a single logo and store it in cache.
+
+    :param url       : url of logo
+    :param cache_path: folder of cache
+
+    :return          : url, hash and file extension of logo
+
+    """
+
+    page = _session().get(url, timeout=TIMEOUT)
+
+    page.raise_for_status()
+
+    return (url,) + store_logo(page.content, cache_path)
+
+
+def _read_manifest(cache_path: str) -> dict:
+    """
+
+    Read urls already mirrored.
+
+    :param cache_path: folder of cache
+
+    :return          : dict of url and (hash, extension)
+
+    """
+
+    manifest : dict[str, tuple] = dict()
+
+    manifest_path = os.path.join(cache_path, "manifest.csv")
+
+    if not os.path.exists(manifest_path):
+        return manifest
+
+    with open(manifest_path, 'r', encoding='UTF8', newline='') as f:
+
+        for row in csv.DictReader(f):
+            manifest[row["url"]] = (row["hash"], row["extension"])
+
+    return manifest
+
+
+def mirror_logos(urls: list, cache_path: str = CACHE_PATH, workers: int = WORKERS, verbose: bool = False) -> dict:
+    """
+
+    Download logos concurrently, urls already in manifest are not downloaded again.
+
+    :param urls      : list of logo urls
+    :param cache_path: folder of cache
+    :param workers   : number of concurrent downloads
+    :param verbose   : print failed urls
+
+    :return          : dict of url and (hash, extension) for mirrored logos
+
+    """
+
+    os.makedirs(cache_path, exist_ok=True)
+
+    manifest = _read_manifest(cache_path)
+
+    # same url is shared by many universities, download each once
+    to_download = sorted({url for url in urls if url not in manifest})
+
+    mirrored : list = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        futures = {executor.submit(_mirror_single_logo, url, cache_path): url for url in to_download}
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+
+            try:
+                url, digest, extension = future.result()
+            except Exception as error:
+
+                if verbose:
+                    print(f"Failed {futures[future]}: {error}")
+
+                continue
+
+            manifest[url] = (digest, extension)
+            mirrored.append([url, digest, extension])
+
+    manifest_path = os.path.join(cache_path, "manifest.csv")
+    is_new        = not os.path.exists(manifest_path)
+
+    # manifest is append only, it is read back into a dict so the last row of an url wins
+    with open(manifest_path, 'a', encoding='UTF8', newline='') as f:
+        writer = csv.writer(f)
+
+        if is_new:
+            writer.writerow(MANIFEST_COLUMNS)
+
+        writer.writerows(mirrored)
+
+    return manifest
+
+
+def mirror_university_logos(csv_name: str = "universities", cache_path: str = CACHE_PATH,
+                            asset_url: str = ASSET_URL, workers: int = WORKERS, verbose: bool = True) -> None:
+    """
+
+    Mirror logos of universities and rewrite universities.image to local assets.
+
+    :param csv_name  : name of universities .csv file
+    :param cache_path: folder of cache
+    :param asset_url : prefix of rewritten image urls
+    :param workers   : number of concurrent downloads
+    :param verbose   : print summary
+
+    :return          : None
+
+    """
+
+    # keep other columns as they are
+    universities = pd.read_csv(f"{PATH}{csv_name}.csv", dtype=str, keep_default_na=False)
+
+    # images already pointing to local assets are not downloaded
+    is_remote = universities["image"].str.startswith("http") & ~universities["image"].str.startswith(asset_url)
+
+    manifest = mirror_logos(list(universities.loc[is_remote, "image"]), cache_path, workers, verbose)
+
+    local_urls = {url: f"{asset_url}{_asset_path(digest, extension)}" for url, (digest, extension) in manifest.items()}
+
+    rewritten = universities.loc[is_remote, "image"].map(local_urls)
+
+    universities.loc[is_remote, "image"] = rewritten.fillna(universities.loc[is_remote, "image"])
+
+    if verbose:
+
+        print(f"Rewritten: {int(rewritten.notna().sum())} Distinct logos: {rewritten.nunique()} Failed: {int(rewritten.isna().sum())}")
+
+    universities.to_csv(f"{PATH}{csv_name}.csv", index=False)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Mirror university logos into a local cache.")
+
+    parser.add_argument("--cache-path", default=CACHE_PATH, help="folder of cache")
+    parser.add_argument("--asset-url", default=ASSET_URL, help="prefix of rewritten image urls")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of concurrent downloads")
+
+    args = parser.parse_args()
+
+    # start mirroring
+    mirror_university_logos(cache_path=args.cache_path, asset_url=args.asset_url, workers=args.workers)
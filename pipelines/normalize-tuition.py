@@ -0,0 +1,157 @@
+"""
+Normalization of master program tuition to a base currency.
+
+tution_amount is stored in the currency of tution_currency, so programs
+cannot be compared by cost in the database. This stage converts tuition to
+USD with a local, versioned exchange rate table and adds annual cost using
+the duration of the program. Both columns are integers and indexed, so cost
+range queries are plain index range scans.
+
+Exchange rate tables are kept in RATES_PATH and named by version, for
+example 2022-01.csv. The version used is stored with each row.
+
+The new columns must exist in the database before the rows are synced.
+sync-database.py runs INDEX_STATEMENTS first when masters has the new
+columns, they are also written to masters-tuition.sql for databases loaded
+by hand.
+
+usage:
+
+    python normalize-tuition.py --rates-version 2022-01
+    python sync-database.py --dsn postgresql://
+
+author: @firattamur
+"""
+
+
+import argparse
+import pandas as pd
+
+
+# folder path
+PATH       = "../data-version2/final/"
+RATES_PATH = "../data-version2/raw/exchange-rates/"
+SQL_PATH   = "../data-version2/"
+
+# default exchange rate table
+RATES_VERSION = "2022-01"
+
+# base currency all tuition is converted to
+BASE_CURRENCY = "USD"
+
+# new columns of masters table
+NORMALIZED_COLUMNS = ["tution_amount_usd", "annual_tution_usd", "tution_rates_version"]
+
+# run before new columns are loaded, cost of living index is joined with cost of programs
+INDEX_STATEMENTS = [
+
+    'ALTER TABLE "masters" ADD COLUMN IF NOT EXISTS "tution_amount_usd" INTEGER;',
+    'ALTER TABLE "masters" ADD COLUMN IF NOT EXISTS "annual_tution_usd" INTEGER;',
+    'ALTER TABLE "masters" ADD COLUMN IF NOT EXISTS "tution_rates_version" TEXT;',
+    'CREATE INDEX IF NOT EXISTS "masters_tution_amount_usd" ON "masters" ("tution_amount_usd");',
+    'CREATE INDEX IF NOT EXISTS "masters_annual_tution_usd" ON "masters" ("annual_tution_usd");',
+    'CREATE INDEX IF NOT EXISTS "cities_cost_of_living_index" ON "cities" ("cost_of_living_index");',
+
+]
+
+
+def load_rates(version: str = RATES_VERSION) -> pd.Series:
+    """
+
+    Read exchange rate table of a version.
+
+    :param version: name of exchange rate table
+
+    :return       : series of base currency per unit indexed by currency code
+
+    """
+
+    rates = pd.read_csv(f"{RATES_PATH}{version}.csv")
+
+    return rates.set_index("currency")[f"{BASE_CURRENCY.lower()}_per_unit"]
+
+
+def normalize_tuition(masters: pd.DataFrame, rates: pd.Series, version: str) -> pd.DataFrame:
+    """
+
+    Add tuition in base currency and annual tuition in base currency.
+
+    Tuition is the cost of the whole program. Annual tuition divides it by the
+    number of years, programs shorter than a year cost the same per year.
+
+    :param masters: masters table
+    :param rates  : base currency per unit indexed by currency code
+    :param version: version of exchange rate table
+
+    :return       : masters table with NORMALIZED_COLUMNS
+
+    """
+
+    masters = masters.copy()
+
+    amount   = pd.to_numeric(masters["tution_amount"], errors="coerce")
+    duration = pd.to_numeric(masters["duration"], errors="coerce")
+
+    # some currencies have leading spaces like ' AED'
+    rate = masters["tution_currency"].str.strip().map(rates)
+
+    amount_base = amount * rate
+
+    years = duration.where(duration > 0).clip(lower=12) / 12
+
+    masters["tution_amount_usd"]    = amount_base.round().astype("Int64")
+    masters["annual_tution_usd"]    = (amount_base / years).round().astype("Int64")
+    masters["tution_rates_version"] = version
+
+    masters.loc[masters["tution_amount_usd"].isna(), "tution_rates_version"] = pd.NA
+
+    return masters
+
+
+def normalize(version: str = RATES_VERSION, csv_name: str = "masters", verbose: bool = True) -> None:
+    """
+
+    Normalize tuition of final masters table and write index statements.
+
+    :param version : version of exchange rate table
+    :param csv_name: name of masters .csv file
+    :param verbose : print number of converted programs
+
+    :return        : None
+
+    """
+
+    # keep other columns as they are
+    masters = pd.read_csv(f"{PATH}{csv_name}.csv", dtype=str, keep_default_na=False)
+
+    masters = masters.drop(columns=NORMALIZED_COLUMNS, errors="ignore")
+    masters = masters.replace("", pd.NA)
+
+    normalized = normalize_tuition(masters, load_rates(version), version)
+
+    if verbose:
+
+        has_amount = pd.to_numeric(normalized["tution_amount"], errors="coerce").notna()
+        missing    = has_amount & normalized["tution_amount_usd"].isna()
+
+        print(f"Converted: {int(normalized['tution_amount_usd'].notna().sum())}")
+
+        if missing.any():
+            print(f"No exchange rate: {normalized.loc[missing, 'tution_currency'].str.strip().value_counts().to_dict()}")
+
+    normalized.to_csv(f"{PATH}{csv_name}.csv", index=False)
+
+    with open(f"{SQL_PATH}masters-tuition.sql", 'w', encoding='UTF8') as f:
+        f.write("\n".join(INDEX_STATEMENTS) + "\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convert master program tuition to a base currency.")
+
+    parser.add_argument("--rates-version", default=RATES_VERSION, help="name of exchange rate table")
+
+    args = parser.parse_args()
+
+    # start normalization
+    normalize(version=args.rates_version)
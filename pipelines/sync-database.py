@@ -0,0 +1,571 @@
+"""
+Incremental database sync of final tables.
+
+Final tables are regenerated with new positional ids on every refresh. This
+stage matches new rows to the rows already in the database by natural keys,
+keeps their ids, and writes only the difference as batched INSERT, UPDATE and
+DELETE statements. Changed rows are found by comparing hashed fingerprints of
+rows with the same id.
+
+The tables as they are in the database are kept in SNAPSHOT_PATH. After the
+statements are written (and applied if a connection string is given) the
+snapshot is replaced with the new tables, so the next refresh is compared
+against it. A written .sql file must be applied before the next sync.
+
+Only masters, universities and cities are synced. Admins and users are
+created once for each university and keep pointing to the same university
+because university ids do not change anymore.
+
+Later stages add columns to final tables, like normalize-tuition.py adds
+tuition in USD to masters. When final tables have such columns, the schema
+statements of the stage (ALTER TABLE ... ADD COLUMN IF NOT EXISTS and its
+indexes) run first in the same transaction, so the database has the columns
+before rows are inserted or updated.
+
+usage:
+
+    python sync-database.py --bootstrap          # once, final tables are already loaded
+    python normalize-tuition.py                  # optional, adds columns to masters
+    python sync-database.py                      # write statements to .sql file
+    python sync-database.py --dsn postgresql://  # also apply them
+
+author: @firattamur
+"""
+
+
+import io
+import os
+import argparse
+import importlib.util
+import psycopg2
+import pandas as pd
+
+
+# folder path
+PATH          = "../data-version2/final/"
+SNAPSHOT_PATH = "../data-version2/synced/"
+
+# folder of the stages, they are loaded from file because of '-' in names
+PIPELINES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# every table has an integer id column as primary key
+PRIMARY_KEY = "id"
+
+# tables in the order they are inserted, deletes run in reverse order
+TABLES = ["cities", "universities", "masters"]
+
+# natural keys of tables, referenced ids are replaced with natural key of referenced table
+NATURAL_KEYS = {
+
+    "cities"      : ["name", "country"],
+    "universities": ["name"],
+    "masters"     : ["university", "name", "mode", "schedule", "language", "field"],
+
+}
+
+# table, column, referenced table
+FOREIGN_KEYS = [
+
+    ("universities", "cityId",        "cities"),
+    ("masters",      "university_id", "universities"),
+
+]
+
+# table, column added by a later stage, stage with INDEX_STATEMENTS creating the column
+STAGE_COLUMNS = [
+
+    ("masters", "tution_amount_usd", "normalize-tuition"),
+
+]
+
+# number of rows in a single INSERT statement or DELETE id list, updates are inserted in batches too
+BATCH_SIZE = 1000
+
+
+def _foreign_key_text(ids: pd.Series) -> pd.Series:
+    """
+
+    Write foreign key ids like '12' whether they were read as '12', '12.0' or numbers.
+
+    """
+
+    return ids.astype("Int64").astype(str).where(ids.notna())
+
+
+def _normalize_ids(frame: pd.DataFrame, table: str) -> pd.DataFrame:
+    """
+
+    Convert id column to integers and foreign key columns to integer text, so
+    the same row read from a .csv file or database has the same fingerprint.
+
+    :param frame: dataframe of the table
+    :param table: name of the table
+
+    :return     : dataframe with normalized ids
+
+    """
+
+    frame[PRIMARY_KEY] = frame[PRIMARY_KEY].astype(float).astype(int)
+
+    for foreign_table, column, _ in FOREIGN_KEYS:
+
+        if foreign_table == table:
+            frame[column] = _foreign_key_text(pd.to_numeric(frame[column]))
+
+    return frame
+
+
+def _read_table(path: str, table: str) -> pd.DataFrame:
+    """
+
+    Read a table from .csv file, empty cells and NULL are missing values.
+
+    :param path : folder of the table
+    :param table: name of the table
+
+    :return     : dataframe with integer ids
+
+    """
+
+    frame = pd.read_csv(f"{path}{table}.csv", dtype=str, keep_default_na=False, na_values=["", "NULL"])
+
+    return _normalize_ids(frame, table)
+
+
+def _natural_key(frame: pd.DataFrame, table: str) -> pd.Series:
+    """
+
+    Build natural key of each row as a single string.
+
+    Rows with the same natural key are numbered, so duplicates are matched
+    with duplicates instead of being dropped. They are numbered in the order
+    of their other columns, not their position, so reordered rows keep their
+    numbers.
+
+    :param frame: dataframe of the table
+    :param table: name of the table
+
+    :return     : series of keys
+
+    """
+
+    columns = NATURAL_KEYS[table]
+
+    # ids and foreign keys are positional in regenerated tables, they cannot order rows
+    positional = [PRIMARY_KEY] + [column for foreign_table, column, _ in FOREIGN_KEYS if foreign_table == table]
+
+    values = frame.drop(columns=positional).fillna("").astype(str)
+
+    order = values.sort_values(by=columns + [column for column in values.columns if column not in columns], kind="mergesort").index
+
+    occurrence = values.loc[order, columns].groupby(columns, sort=False).cumcount().reindex(frame.index).astype(str)
+
+    return values[columns[0]].str.cat([values[column] for column in columns[1:]] + [occurrence], sep="\x1f")
+
+
+def _fingerprint(frame: pd.DataFrame) -> pd.Series:
+    """
+
+    Hash all columns except id of each row.
+
+    :param frame: dataframe of the table
+
+    :return     : series of uint64 hashes indexed by id
+
+    """
+
+    columns = [column for column in frame.columns if column != PRIMARY_KEY]
+
+    hashes = pd.util.hash_pandas_object(frame[columns], index=False)
+
+    hashes.index = frame[PRIMARY_KEY].to_numpy()
+
+    return hashes
+
+
+def assign_stable_ids(old: dict, new: dict) -> dict:
+    """
+
+    Replace positional ids of new tables with ids of matching old rows.
+
+    New rows get ids after the largest old id. Foreign keys are remapped
+    through the ids of the referenced table.
+
+    :param old: dict of table name and dataframe in database
+    :param new: dict of table name and regenerated dataframe
+
+    :return   : dict of table name and dataframe with stable ids
+
+    """
+
+    stable    : dict[str, pd.DataFrame] = dict()
+    id_change : dict[str, pd.Series]    = dict()
+
+    for table in TABLES:
+
+        old_frame = old[table].copy()
+        new_frame = new[table].copy()
+
+        # natural key of masters needs university name instead of university id
+        if table == "masters":
+            old_frame["university"] = old_frame["university_id"].astype(float).map(old["universities"].set_index(PRIMARY_KEY)["name"])
+            new_frame["university"] = new_frame["university_id"].astype(float).map(new["universities"].set_index(PRIMARY_KEY)["name"])
+
+        old_keys = _natural_key(old_frame, table)
+        new_keys = _natural_key(new_frame, table)
+
+        # hash lookup of old id for each new key
+        matched = new_keys.map(pd.Series(old_frame[PRIMARY_KEY].to_numpy(), index=old_keys.to_numpy()))
+
+        # new rows get ids after the largest id in database
+        next_id  = int(old_frame[PRIMARY_KEY].max()) + 1 if len(old_frame) else 0
+        missing  = matched.isna()
+
+        if missing.any():
+            matched = matched.astype(float)
+            matched[missing] = list(range(next_id, next_id + int(missing.sum())))
+
+        # positional ids are copied, the id column is overwritten below and must not change the index
+        id_change[table] = pd.Series(matched.astype(int).to_numpy(), index=new_frame[PRIMARY_KEY].to_numpy().copy())
+
+        new_frame[PRIMARY_KEY] = id_change[table].to_numpy()
+
+        stable[table] = new_frame.drop(columns=["university"], errors="ignore")
+
+    for table, column, referenced in FOREIGN_KEYS:
+
+        ids = stable[table][column].astype(float).map(id_change[referenced])
+
+        stable[table][column] = _foreign_key_text(ids)
+
+    return stable
+
+
+def diff(old: pd.DataFrame, new: pd.DataFrame) -> tuple:
+    """
+
+    Find inserted, updated and deleted rows between two versions of a table with stable ids.
+
+    :param old: table in database
+    :param new: table with stable ids
+
+    :return   : inserted rows, updated rows and deleted ids
+
+    """
+
+    old_hashes = _fingerprint(old)
+    new_hashes = _fingerprint(new)
+
+    inserted = ~new_hashes.index.isin(old_hashes.index)
+    deleted  = old_hashes.index[~old_hashes.index.isin(new_hashes.index)]
+
+    # compare fingerprints of rows in both versions
+    common  = new_hashes.index[~inserted]
+    changed = common[new_hashes.loc[common].to_numpy() != old_hashes.loc[common].to_numpy()]
+
+    new = new.set_index(PRIMARY_KEY, drop=False)
+
+    return new.loc[inserted].reset_index(drop=True), new.loc[changed].reset_index(drop=True), list(deleted)
+
+
+def _quote(value) -> str:
+    """
+
+    Convert a value to a SQL literal.
+
+    :param value: value from dataframe
+
+    :return     : SQL literal
+
+    """
+
+    if pd.isna(value):
+        return "NULL"
+
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _identifier(name: str) -> str:
+    """
+
+    Quote a column or table name, some columns like cityId are case sensitive.
+
+    """
+
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _insert_statements(table: str, rows: pd.DataFrame) -> list:
+    """
+
+    Create INSERT statements with BATCH_SIZE rows each.
+
+    :param table: name of the table
+    :param rows : rows to insert
+
+    :return     : list of statements
+
+    """
+
+    statements : list[str] = []
+
+    columns = ", ".join(_identifier(column) for column in rows.columns)
+
+    for start in range(0, len(rows), BATCH_SIZE):
+
+        batch = rows.iloc[start:start + BATCH_SIZE]
+
+        values = ",\n".join("(" + ", ".join(_quote(value) for value in row) + ")" for row in batch.itertuples(index=False))
+
+        statements.append(f"INSERT INTO {_identifier(table)} ({columns}) VALUES\n{values};")
+
+    return statements
+
+
+def to_statements(table: str, inserted: pd.DataFrame, updated: pd.DataFrame, deleted: list) -> tuple:
+    """
+
+    Create batched statements for difference of a table.
+
+    Updated rows are inserted into a temporary table with the same column
+    types as the table, then all of them are updated by a single join.
+
+    :param table   : name of the table
+    :param inserted: rows to insert
+    :param updated : rows to update
+    :param deleted : ids to delete
+
+    :return        : list of insert and update statements, list of delete statements
+
+    """
+
+    statements : list[str] = []
+    deletes    : list[str] = []
+
+    statements.extend(_insert_statements(table, inserted))
+
+    if len(updated):
+
+        changes = f"sync_{table}"
+
+        assignments = ", ".join(f"{_identifier(column)} = changes.{_identifier(column)}" for column in updated.columns if column != PRIMARY_KEY)
+
+        statements.append(f"CREATE TEMPORARY TABLE {_identifier(changes)} (LIKE {_identifier(table)} INCLUDING DEFAULTS) ON COMMIT DROP;")
+        statements.extend(_insert_statements(changes, updated))
+        statements.append(
+            f"UPDATE {_identifier(table)} AS target SET {assignments} FROM {_identifier(changes)} AS changes "
+            f"WHERE target.{_identifier(PRIMARY_KEY)} = changes.{_identifier(PRIMARY_KEY)};"
+        )
+
+    for start in range(0, len(deleted), BATCH_SIZE):
+
+        ids = ", ".join(str(deleted_id) for deleted_id in deleted[start:start + BATCH_SIZE])
+
+        deletes.append(f"DELETE FROM {_identifier(table)} WHERE {_identifier(PRIMARY_KEY)} IN ({ids});")
+
+    return statements, deletes
+
+
+def _load_stage(name: str):
+    """
+
+    Load a pipeline stage module.
+
+    :param name: name of the stage file without .py
+
+    :return    : stage module
+
+    """
+
+    spec   = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(PIPELINES_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def schema_statements(tables: dict) -> list:
+    """
+
+    Schema statements of later stages whose columns are in the final tables.
+
+    Statements only add missing columns and indexes, so they can run on every sync.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of statements
+
+    """
+
+    statements : list[str] = []
+
+    for table, column, stage in STAGE_COLUMNS:
+
+        if column not in tables[table].columns:
+            continue
+
+        for statement in _load_stage(stage).INDEX_STATEMENTS:
+
+            if statement not in statements:
+                statements.append(statement)
+
+    return statements
+
+
+def _read_database_table(connection, table: str, columns: list) -> pd.DataFrame:
+    """
+
+    Read a table from database in the same format as the .csv files.
+
+    Columns not yet added to the database are not read, their rows are updated.
+
+    :param connection: psycopg2 connection
+    :param table     : name of the table
+    :param columns   : columns to read
+
+    :return          : dataframe with integer ids
+
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+        existing = {column for (column,) in cursor.fetchall()}
+
+    selected = ", ".join(_identifier(column) for column in columns if column in existing)
+
+    buffer = io.StringIO()
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY (SELECT {selected} FROM {_identifier(table)}) TO STDOUT WITH CSV HEADER", buffer)
+
+    buffer.seek(0)
+
+    frame = pd.read_csv(buffer, dtype=str, keep_default_na=False, na_values=["", "NULL"])
+
+    return _normalize_ids(frame, table)
+
+
+def bootstrap(path: str = PATH, snapshot_path: str = SNAPSHOT_PATH) -> None:
+    """
+
+    Seed the snapshot from final tables which are already loaded into the database.
+
+    Used once for a database loaded by MasterProgramsToPostgres, the ids in
+    the database are kept and the next sync only writes the difference.
+
+    :param path         : folder of final tables loaded into the database
+    :param snapshot_path: folder of tables as they are in database
+
+    :return             : None
+
+    """
+
+    for table in TABLES:
+        _read_table(path, table).to_csv(f"{snapshot_path}{table}.csv", index=False)
+
+
+def sync(path: str = PATH, snapshot_path: str = SNAPSHOT_PATH, sql_name: str = "sync", dsn: str = None, verbose: bool = True) -> list:
+    """
+
+    Compare regenerated final tables with the snapshot of database and write the difference.
+
+    Without a snapshot, the tables are read from the database if a connection
+    string is given. Otherwise the snapshot must be seeded with bootstrap.
+
+    :param path         : folder of regenerated final tables
+    :param snapshot_path: folder of tables as they are in database
+    :param sql_name     : name of .sql file to keep statements
+    :param dsn          : postgres connection string, statements are only written if None
+    :param verbose      : print number of changed rows
+
+    :return             : list of statements in the order they run
+
+    """
+
+    new = {table: _read_table(path, table) for table in TABLES}
+
+    if os.path.exists(f"{snapshot_path}{TABLES[0]}.csv"):
+
+        old = {table: _read_table(snapshot_path, table) for table in TABLES}
+
+    elif dsn is not None:
+
+        with psycopg2.connect(dsn) as connection:
+            old = {table: _read_database_table(connection, table, list(new[table].columns)) for table in TABLES}
+
+    else:
+        raise FileNotFoundError(f"No snapshot in {snapshot_path}, run with --bootstrap if final tables are loaded or give --dsn.")
+
+    stable = assign_stable_ids(old, new)
+
+    statements : list[str] = []
+    deletes    : list[str] = []
+
+    for table in TABLES:
+
+        inserted, updated, deleted = diff(old[table], stable[table])
+
+        table_statements, table_deletes = to_statements(table, inserted, updated, deleted)
+
+        statements.extend(table_statements)
+
+        # children are deleted before parents
+        deletes = table_deletes + deletes
+
+        if verbose:
+            print(f"{table} - Insert: {len(inserted)} Update: {len(updated)} Delete: {len(deleted)}")
+
+    schema = schema_statements(new)
+
+    if verbose and schema:
+        print(f"Schema statements: {len(schema)}")
+
+    statements = schema + statements + deletes
+
+    with open(f"{snapshot_path}{sql_name}.sql", 'w', encoding='UTF8') as f:
+        f.write("BEGIN;\n\n" + "\n\n".join(statements) + "\n\nCOMMIT;\n")
+
+    if dsn is not None:
+
+        # single transaction, either all differences are applied or none
+        with psycopg2.connect(dsn) as connection:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+    # snapshot is replaced after the database is updated, .sql file must be applied before the next sync
+    for table in TABLES:
+        stable[table].to_csv(f"{snapshot_path}{table}.csv", index=False)
+
+    return statements
+
+
+def main():
+    """
+
+    Command line entry for sync.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Sync regenerated final tables to database incrementally.")
+
+    parser.add_argument("--path", default=PATH, help="folder of regenerated final tables")
+    parser.add_argument("--snapshot-path", default=SNAPSHOT_PATH, help="folder of tables as they are in database")
+    parser.add_argument("--dsn", help="postgres connection string, statements are only written without it")
+    parser.add_argument("--bootstrap", action="store_true", help="seed snapshot from final tables already loaded into database")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.snapshot_path, exist_ok=True)
+
+    if args.bootstrap:
+        bootstrap(path=args.path, snapshot_path=args.snapshot_path)
+    else:
+        sync(path=args.path, snapshot_path=args.snapshot_path, dsn=args.dsn)
+
+
+if __name__ == "__main__":
+
+    # start sync
+    main()
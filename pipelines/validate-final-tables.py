@@ -0,0 +1,377 @@
+"""
+Validation of final tables before importing them to postgres.
+
+Checks primary keys, foreign keys between final tables, enum columns and
+that admins and users line up. All checks are vectorized column operations,
+foreign keys are hash lookups with isin, so the whole run takes about a
+second and can gate every refresh. Offending rows are written to a report.
+
+author: @firattamur
+"""
+
+
+import sys
+import pandas as pd
+
+
+# folder path
+PATH        = "../data-version2/final/"
+REPORT_PATH = "../data-version2/"
+
+# final tables and their .csv files
+TABLES = {
+
+    "masters"     : "masters",
+    "universities": "universities",
+    "cities"      : "cities",
+    "admins"      : "admins",
+    "users"       : "users",
+
+}
+
+# every table has an integer id column as primary key
+PRIMARY_KEY = "id"
+
+# table, column, referenced table, referenced column
+# null values are allowed in foreign key columns
+FOREIGN_KEYS = [
+
+    ("masters",      "university_id", "universities", "id"),
+    ("universities", "cityId",        "cities",       "id"),
+    ("admins",       "user_id",       "users",        "id"),
+    ("admins",       "university_id", "universities", "id"),
+
+]
+
+# allowed values of enum columns, null values are allowed
+ENUMS = {
+
+    ("masters", "mode")    : {"CAMPUS", "ONLINE", "COMBINED"},
+    ("masters", "schedule"): {"FULLTIME", "PARTTIME"},
+    ("masters", "field")   : {
+        "ADMINISTRATION", "ARCHITECTURE", "ART", "AVIATION", "BUSINESS", "CONSTRUCTION",
+        "COSMETOLOGY", "DESIGN", "ECONOMIC", "EDUCATION", "ENERGY", "ENGINEERING",
+        "ENVIRONMENTAL", "FASHION", "FOOD_AND_BEVERAGE", "GENERAL", "HEALTHCARE",
+        "HUMANITIES", "JOURNALISM_AND_MASSCOMMUNICATION", "LANGUAGES", "LAW", "LIFE",
+        "LIFESKILLS", "MANAGEMENT", "MARKETING", "NATURAL", "PERFORMINGARTS",
+        "PROFESSIONAL", "SELFIMPROVEMENT", "SOCIAL", "SPORT", "SUSTAINABILITY",
+        "TECHNOLOGY", "TOURISM_AND_HOSPITALITY",
+    },
+
+}
+
+# columns which must hold integers, null values are allowed
+# columns added by later stages are skipped if the stage did not run
+INTEGER_COLUMNS = {
+
+    "masters"     : ["university_id", "duration", "tution_amount_usd", "annual_tution_usd"],
+    "universities": ["cityId"],
+    "admins"      : ["user_id", "university_id"],
+
+}
+
+# columns which must hold numbers, null values are allowed
+# tuition is kept in its currency with decimals, like 12500.5
+NUMERIC_COLUMNS = {
+
+    "masters": ["tution_amount"],
+
+}
+
+# columns of report
+REPORT_COLUMNS = ["table", "id", "check", "column", "value"]
+
+
+def load_final_tables(path: str = PATH) -> dict:
+    """
+
+    Read final tables from .csv files.
+
+    Empty cells and NULL are read as missing values, everything else as string
+    so no value is changed before it is checked.
+
+    :param path: folder of the final tables
+
+    :return    : dict of table name and dataframe
+
+    """
+
+    tables : dict[str, pd.DataFrame] = dict()
+
+    for table, csv_name in TABLES.items():
+        tables[table] = pd.read_csv(f"{path}{csv_name}.csv", dtype=str, keep_default_na=False, na_values=["", "NULL"])
+
+    return tables
+
+
+def _as_integer(column: pd.Series) -> pd.Series:
+    """
+
+    Convert a string column to nullable integers. Values like '12.0' are integers.
+
+    :param column: column of strings
+
+    :return      : column of integers, missing for values which are not integer
+
+    """
+
+    numbers = pd.to_numeric(column, errors="coerce")
+
+    numbers = numbers.where(numbers.mod(1).eq(0))
+
+    return numbers.astype("Int64")
+
+
+def _violations(table: pd.DataFrame, name: str, mask: pd.Series, check: str, column: str) -> pd.DataFrame:
+    """
+
+    Collect rows selected by mask into report layout.
+
+    :param table : dataframe of the table
+    :param name  : name of the table
+    :param mask  : boolean series, True for offending rows
+    :param check : name of the check
+    :param column: checked column
+
+    :return      : offending rows in REPORT_COLUMNS layout
+
+    """
+
+    offending = table.loc[mask]
+
+    return pd.DataFrame({
+        "table" : name,
+        "id"    : offending[PRIMARY_KEY],
+        "check" : check,
+        "column": column,
+        "value" : offending[column],
+    }, columns=REPORT_COLUMNS)
+
+
+def check_primary_keys(tables: dict) -> list:
+    """
+
+    Check that id columns are unique, not null integers.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    reports : list = []
+
+    for name, table in tables.items():
+
+        ids = _as_integer(table[PRIMARY_KEY])
+
+        reports.append(_violations(table, name, ids.isna().to_numpy(), "primary key not integer", PRIMARY_KEY))
+        reports.append(_violations(table, name, table[PRIMARY_KEY].duplicated(keep=False).to_numpy(), "primary key duplicated", PRIMARY_KEY))
+
+    return reports
+
+
+def check_integer_columns(tables: dict) -> list:
+    """
+
+    Check that integer columns hold only integers or null.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    reports : list = []
+
+    for name, columns in INTEGER_COLUMNS.items():
+
+        table = tables[name]
+
+        for column in columns:
+
+            if column not in table.columns:
+                continue
+
+            mask = table[column].notna() & _as_integer(table[column]).isna()
+
+            reports.append(_violations(table, name, mask.to_numpy(), "not integer", column))
+
+    return reports
+
+
+def check_numeric_columns(tables: dict) -> list:
+    """
+
+    Check that numeric columns hold only finite numbers or null.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    reports : list = []
+
+    for name, columns in NUMERIC_COLUMNS.items():
+
+        table = tables[name]
+
+        for column in columns:
+
+            if column not in table.columns:
+                continue
+
+            numbers = pd.to_numeric(table[column], errors="coerce")
+
+            mask = table[column].notna() & ~(numbers.notna() & numbers.abs().lt(float("inf")))
+
+            reports.append(_violations(table, name, mask.to_numpy(), "not numeric", column))
+
+    return reports
+
+
+def check_foreign_keys(tables: dict) -> list:
+    """
+
+    Check that foreign key columns point to existing rows.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    reports : list = []
+
+    for name, column, referenced, referenced_column in FOREIGN_KEYS:
+
+        table = tables[name]
+
+        keys            = _as_integer(table[column])
+        referenced_keys = _as_integer(tables[referenced][referenced_column]).dropna().unique()
+
+        # isin builds a hash table of referenced keys, a hash join without materializing the join
+        mask = keys.notna() & ~keys.isin(referenced_keys)
+
+        reports.append(_violations(table, name, mask.to_numpy(), f"missing {referenced}.{referenced_column}", column))
+
+    return reports
+
+
+def check_enums(tables: dict) -> list:
+    """
+
+    Check that enum columns hold only allowed values.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    reports : list = []
+
+    for (name, column), allowed in ENUMS.items():
+
+        table = tables[name]
+
+        mask = table[column].notna() & ~table[column].isin(allowed)
+
+        reports.append(_violations(table, name, mask.to_numpy(), "not allowed value", column))
+
+    return reports
+
+
+def check_admin_users(tables: dict) -> list:
+    """
+
+    Check that each admin has the same username as its user and the user has admin role.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : list of report dataframes
+
+    """
+
+    admins = tables["admins"]
+    users  = tables["users"]
+
+    # ids are compared as integers like in foreign key check, '2' and '2.0' are the same user
+    user_ids  = _as_integer(users[PRIMARY_KEY])
+    admin_ids = _as_integer(admins["user_id"])
+
+    users    = users[user_ids.notna().to_numpy() & ~user_ids.duplicated().to_numpy()]
+    user_ids = pd.Index(_as_integer(users[PRIMARY_KEY]).astype("int64"))
+
+    # hash lookup of user row of each admin, missing users are reported by foreign key check
+    positions = user_ids.get_indexer(admin_ids.fillna(-1).astype("int64"))
+
+    has_user = (positions >= 0) & admin_ids.notna().to_numpy()
+
+    usernames = users["username"].to_numpy()[positions]
+    roles     = users["role"].to_numpy()[positions]
+
+    reports = [
+        _violations(admins, "admins", has_user & (usernames != admins["username"].to_numpy()), "username differs from users.username", "username"),
+        _violations(admins, "admins", has_user & (roles != "UNIVERSITYADMIN"), "user role is not UNIVERSITYADMIN", "user_id"),
+    ]
+
+    return reports
+
+
+def validate(tables: dict) -> pd.DataFrame:
+    """
+
+    Run all checks over final tables.
+
+    :param tables: dict of table name and dataframe
+
+    :return      : offending rows in REPORT_COLUMNS layout, empty if tables are valid
+
+    """
+
+    reports : list = []
+
+    reports.extend(check_primary_keys(tables))
+    reports.extend(check_integer_columns(tables))
+    reports.extend(check_numeric_columns(tables))
+    reports.extend(check_foreign_keys(tables))
+    reports.extend(check_enums(tables))
+    reports.extend(check_admin_users(tables))
+
+    return pd.concat(reports, ignore_index=True)
+
+
+def validate_final_tables(path: str = PATH, report_name: str = "validation-report", verbose: bool = True) -> bool:
+    """
+
+    Validate final tables and write offending rows to a .csv report.
+
+    :param path       : folder of the final tables
+    :param report_name: name of .csv file to keep offending rows
+    :param verbose    : print summary of checks
+
+    :return           : True if there is no offending row
+
+    """
+
+    report = validate(load_final_tables(path))
+
+    report.to_csv(f"{REPORT_PATH}{report_name}.csv", index=False)
+
+    if verbose:
+
+        if report.empty:
+            print("All checks passed.")
+
+        for (table, check, column), rows in report.groupby(["table", "check", "column"], sort=False):
+            print(f"{table}.{column} - {check}: {len(rows)} rows, ids: {', '.join(rows['id'].astype(str).head(10))}")
+
+    return report.empty
+
+
+if __name__ == "__main__":
+
+    # non zero exit code stops the refresh
+    sys.exit(0 if validate_final_tables() else 1)
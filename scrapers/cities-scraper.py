@@ -5,9 +5,9 @@ author: @firattamur
 """
 
 import csv
-import requests
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from page_archive import fetch
 
 
 # base url for master programs
@@ -64,11 +64,11 @@ def collect_country_urls(url: str) -> dict:
 
     countries : dict[str, str] = dict()
 
-    # request the page
-    page = requests.get(url)
+    # request the page or read it from archive
+    page = fetch(url)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     tables = soup.findAll('table', attrs={ 'class' : 'related_links' })
@@ -102,11 +102,11 @@ def collect_city_urls(url: str, name: str) -> dict:
     # return city name and url
     cities : dict[str, str] = dict()
 
-    # request the page
-    page = requests.get(url)
+    # request the page or read it from archive
+    page = fetch(url)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     selects = soup.findAll('select', attrs={ 'id' : 'city' })
@@ -141,11 +141,11 @@ def collect_quality_indexes(url: str) -> dict:
     # quality index name and the values of the index
     quality_indexes : dict[str, list] = dict()
 
-    # request the page
-    page = requests.get(url)
+    # request the page or read it from archive
+    page = fetch(url)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     tables = soup.findAll('table')
@@ -5,11 +5,13 @@ author: @firattamur
 """
 
 
+import re
 import csv
+import sys
 import json 
-import requests
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from page_archive import fetch
 
 
 # base url for master programs
@@ -71,6 +73,24 @@ CSV_COLUMNS = [
                 "pace", "tution_amount", "tution_currency"
             ]
 
+# duration units converted to months
+# final tables count a semester as 4 months, '2 semesters' is stored as 8
+DURATION_UNITS = {
+
+    "year"    : 12,
+    "semester": 4,
+    "month"   : 1,
+    "week"    : 12 / 52,
+    "day"     : 12 / 365,
+
+}
+
+# matches '2 years', '1.5 year' and ranges like '1 - 2 years'
+DURATION_PATTERN = re.compile(r"(?P<lower>\d+(?:\.\d+)?)(?:\s*-\s*(?P<upper>\d+(?:\.\d+)?))?\s*(?P<unit>[a-zA-Z]+)")
+
+# shared instances of categorical tuples such as ("Campus", "Online")
+_INTERNED_TUPLES : dict[tuple, tuple] = {}
+
 
 def _collect_single_page_programs_url(url: str, verbose: bool = False) -> set:
     """
@@ -85,11 +105,11 @@ def _collect_single_page_programs_url(url: str, verbose: bool = False) -> set:
     """
     programs_url : set[str] = set()
 
-    # request the page
-    page = requests.get(url, timeout=2)
+    # request the page or read it from archive
+    page = fetch(url, timeout=2)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     data = soup.findAll('div', attrs={ 'class' : 'program_title' })
@@ -177,25 +197,167 @@ def collect_all_programs_url(url: str, page_count: int, csv_name: str = "master-
     return program_urls
 
 
-def _collect_single_program_details(url: str, verbose: bool = False) -> dict:
+def _intern(value):
+    """
+
+    Return the shared instance of a categorical value.
+
+    Country, mode, pace, currency etc. repeat in thousands of rows, so every
+    record points to the same object instead of keeping its own copy.
+
+    :param value: string or tuple of strings
+
+    :return     : interned value
+
+    """
+
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return _INTERNED_TUPLES.setdefault(value, value)
+
+
+def _parse_list(raw: str) -> tuple:
+    """
+
+    Parse a json list attribute like '["Full-time","Part-time"]' into an interned tuple.
+
+    :param raw: json encoded list from the page
+
+    :return   : tuple of interned strings
+
+    """
+
+    return _intern(tuple(_intern(item.strip()) for item in json.loads(raw)))
+
+
+def _parse_duration(raw: str) -> int:
+    """
+
+    Convert duration text like '2 years' or '1&nbsp;-&nbsp;3 semesters' to months.
+
+    For ranges the upper bound is used. Durations given in hours are credit
+    hours, not time, so they are returned as None.
+
+    :param raw: duration text from the page
+
+    :return   : duration in months or None
+
+    """
+
+    match = DURATION_PATTERN.search(raw.replace("&nbsp;", " "))
+
+    if match is None:
+        return None
+
+    unit = match.group("unit").lower().rstrip("s")
+
+    if unit not in DURATION_UNITS:
+        return None
+
+    amount = float(match.group("upper") or match.group("lower"))
+
+    return round(amount * DURATION_UNITS[unit])
+
+
+class MasterProgram:
+    """
+
+    Details of a single master program.
+
+    Missing values are None instead of "null", tuition and duration are numeric
+    and categorical values are interned. Slots keep the record small because
+    all of them stay in memory until the final .csv file is written.
+
+    """
+
+    __slots__ = (
+        "field", "name", "university", "duration", "url",
+        "language", "city", "country", "mode", "deadline",
+        "pace", "tution_amount", "tution_currency"
+    )
+
+    def __init__(self, field: str, name: str = None, university: str = None, duration: int = None,
+                 url: str = None, language: tuple = (), city: str = None, country: str = None,
+                 mode: tuple = (), deadline: str = None, pace: tuple = (),
+                 tution_amount: float = None, tution_currency: str = None):
+
+        self.field           = _intern(field)
+        self.name            = name
+        self.university      = _intern(university)
+        self.duration        = duration
+        self.url             = url
+        self.language        = language
+        self.city            = _intern(city)
+        self.country         = _intern(country)
+        self.mode            = mode
+        self.deadline        = deadline
+        self.pace            = pace
+        self.tution_amount   = tution_amount
+        self.tution_currency = _intern(tution_currency)
+
+    def __repr__(self) -> str:
+        return f"MasterProgram({self.field!r}, {self.name!r}, {self.university!r})"
+
+    def __eq__(self, other) -> bool:
+
+        if not isinstance(other, MasterProgram):
+            return NotImplemented
+
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def to_row(self) -> list:
+        """
+
+        Convert record to a row with the same layout as CSV_COLUMNS.
+
+        Duration is written in months and deadline without json quotes, so the
+        duration and deadline steps of MasterProgramsDataCleaning do not parse
+        text anymore. Language, mode and pace stay json lists.
+
+        :return: list of values, "null" for missing ones
+
+        """
+
+        row : list = []
+
+        for column in CSV_COLUMNS:
+
+            value = getattr(self, column)
+
+            if isinstance(value, tuple):
+                row.append(json.dumps(list(value), ensure_ascii=False, separators=(",", ":")))
+            elif value is None:
+                row.append("null")
+            else:
+                row.append(value)
+
+        return row
+
+
+def _collect_single_program_details(url: str, field: str, verbose: bool = False) -> MasterProgram:
     """
 
     Request a single master program url from website collect details.
 
     :param url    : master program url for the website
+    :param field  : field of study the program url is listed under
     :param verbose: print details of request
 
     :return       : return details of program
 
     """
 
-    program_details : list[str] = []
+    program = MasterProgram(field=field)
 
-    # request the page
-    page = requests.get(url)
+    # request the page or read it from archive
+    page = fetch(url)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     data = soup.findAll('locations')[0]
@@ -205,92 +367,82 @@ def _collect_single_program_details(url: str, verbose: bool = False) -> dict:
 
     try:
         # get program details
-        program = json.loads(data[":program"])
-
-        program_details.append(program["name"])
+        program.name = json.loads(data[":program"])["name"]
     except:
-        program_details.append("null")
+        pass
 
     try:
         # university name
-        program_details.append(data[":school"].strip('"'))
+        program.university = _intern(data[":school"].strip('"'))
     except:
-        program_details.append("null")
+        pass
 
     try:
-        # duration 
-        program_details.append(data[":duration"].strip('"'))
+        # duration in months
+        program.duration = _parse_duration(data[":duration"].strip('"'))
     except:
-        program_details.append("null")
+        pass
 
     # program url
     try:
-        program_details.append(soup_description.findAll('a')[0]["href"])
+        program.url = soup_description.findAll('a')[0]["href"]
     except:
-        program_details.append("null")
+        pass
 
     # language
     try:
-        program_details.append(data[":teaching-languages"])
+        program.language = _parse_list(data[":teaching-languages"])
     except:
-        program_details.append("null")
+        pass
 
     # location
     try:
         # get location json object to access city and country
         locations = json.loads(data[":program-locations"])[0]
 
-        # city
-        program_details.append(locations["city"])
-
-        # country
-        program_details.append(locations["country"])
+        program.city    = _intern(locations["city"])
+        program.country = _intern(locations["country"])
     except:
-        # city
-        program_details.append("null")
-
-        # countrys
-        program_details.append("null")
+        pass
         
     try:
         # mode
-        program_details.append(data[":mode"])
-
+        program.mode = _parse_list(data[":mode"])
     except:
-        program_details.append("null")
+        pass
 
     try:
         # deadline
-        program_details.append(data[":deadline"])
+        program.deadline = json.loads(data[":deadline"])
     except:
-        program_details.append("null")
+        pass
 
     # pace
     try:
-        program_details.append(data[":pace"])
+        program.pace = _parse_list(data[":pace"])
     except:
-        program_details.append("null")
+        pass
 
     # tution
     try:
-        # get location json object to access city and country
+        # get price json object to access amount and currency
         price_info = json.loads(data[":price"])
-        
+
         # amount
-        if price_info["price_orig"]["amount"] is not None:
-            program_details.append(price_info["price_orig"]["amount"])
-        else:
+        if price_info["price_orig"]["amount"] is None:
             raise ValueError()
 
-        # currency
-        program_details.append(price_info["price_orig"]["currency"])
+        # amount and currency are set together, a currency without amount is useless
+        amount   = float(price_info["price_orig"]["amount"])
+        amount   = int(amount) if amount.is_integer() else amount
+        currency = _intern(price_info["price_orig"]["currency"].strip())
 
-    except:
-        program_details.append("null")
+        program.tution_amount, program.tution_currency = amount, currency
 
-        program_details.append("null")
+    except:
+        pass
 
-    return program_details    
+    return program
 
 
 def collect_all_programs_detail(read_from_csv: str, csv_name: str, backup_every: int, verbose: bool = False) -> list:
@@ -306,7 +458,7 @@ def collect_all_programs_detail(read_from_csv: str, csv_name: str, backup_every:
 
     """
 
-    all_programs_detail : list[list[str]] = []
+    all_programs_detail : list[MasterProgram] = []
 
     print("Collecting Master Programs Detail...")
 
@@ -332,9 +484,7 @@ def collect_all_programs_detail(read_from_csv: str, csv_name: str, backup_every:
                 program_field, program_url = row[0], row[1]
 
                 # get details of the program
-                program_details = _collect_single_program_details(url = program_url)
-
-                program_details = [program_field] + program_details
+                program_details = _collect_single_program_details(url = program_url, field = program_field)
             
             except:
                 continue
@@ -358,7 +508,7 @@ def collect_all_programs_detail(read_from_csv: str, csv_name: str, backup_every:
                     writer.writerow(CSV_COLUMNS)
 
                     # write multiple rows
-                    writer.writerows(all_programs_detail)
+                    writer.writerows(program.to_row() for program in all_programs_detail)
 
             line_number += 1
 
@@ -372,7 +522,7 @@ def collect_all_programs_detail(read_from_csv: str, csv_name: str, backup_every:
         writer.writerow(CSV_COLUMNS)
 
         # write multiple rows
-        writer.writerows(all_programs_detail)
+        writer.writerows(program.to_row() for program in all_programs_detail)
     
 
 def collect():
@@ -0,0 +1,305 @@
+"""
+Compressed archive of fetched pages for re-parsing without re-fetching.
+
+Every page a scraper fetches is compressed and appended to a segment file,
+and an index keeps url -> (segment, offset, length). In replay mode pages are
+read back through memory mapped segments instead of requests, so a parser
+fix can be applied to all pages without crawling the websites again.
+
+Each process appends to its own segment files, so several scraping workers
+can record into the same archive. The index is a SQLite table, in WAL mode
+by default. WAL journal needs shared memory and only works when all workers
+run on the same host, for workers on several hosts set
+PAGE_ARCHIVE_JOURNAL_MODE=delete. scraping-worker.py passes its
+--journal-mode to the archive.
+
+A page which could not be fetched never replaces a fetched page of the same
+url, and pages archived with an error status raise in replay as they do when
+fetched.
+
+mode is selected with PAGE_ARCHIVE_MODE environment variable:
+
+    record: fetch pages from website and archive them (default)
+    replay: read pages only from archive
+    off   : fetch pages from website without archiving
+
+    PAGE_ARCHIVE_MODE=replay python master-programs-scraper.py
+
+author: @firattamur
+"""
+
+
+import os
+import mmap
+import time
+import zlib
+import socket
+import sqlite3
+import requests
+
+
+# folder path
+ARCHIVE_PATH = os.environ.get("PAGE_ARCHIVE_PATH", "../data-version2/raw/pages/")
+
+# record, replay or off
+MODE = os.environ.get("PAGE_ARCHIVE_MODE", "record")
+
+# sqlite journal mode of the index, wal for single host
+JOURNAL_MODE = os.environ.get("PAGE_ARCHIVE_JOURNAL_MODE", "wal")
+
+# a new segment is started after this many bytes
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+# compression level of pages
+COMPRESSION_LEVEL = 6
+
+SCHEMA = """
+
+CREATE TABLE IF NOT EXISTS pages (
+
+    url        TEXT    PRIMARY KEY,
+    segment    TEXT    NOT NULL,
+    offset     INTEGER NOT NULL,
+    length     INTEGER NOT NULL,
+    status     INTEGER NOT NULL,
+    fetched_at REAL    NOT NULL
+);
+
+"""
+
+
+class PageArchive:
+    """
+
+    Append only segment files of compressed pages with a url index.
+
+    """
+
+    def __init__(self, path: str = ARCHIVE_PATH, journal_mode: str = JOURNAL_MODE):
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+
+        self.index = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=60)
+        self.index.execute(f"PRAGMA journal_mode = {journal_mode}")
+        self.index.executescript(SCHEMA)
+
+        # segment this process appends to
+        self._writer      = None
+        self._segment     = None
+        self._segment_num = 0
+
+        # memory maps of segments by name
+        self._maps : dict[str, mmap.mmap] = dict()
+
+    def _open_segment(self) -> None:
+        """
+
+        Start a new segment file for this process.
+
+        """
+
+        if self._writer is not None:
+            self._writer.close()
+
+        self._segment_num += 1
+
+        self._segment = f"segment-{socket.gethostname()}-{os.getpid()}-{self._segment_num:05d}.bin"
+        self._writer  = open(os.path.join(self.path, self._segment), 'ab')
+
+    def put(self, url: str, content: bytes, status: int = 200) -> None:
+        """
+
+        Compress and append a page, the newest page of an url replaces older ones in the index
+        unless the older page was fetched successfully and the newest was not.
+
+        :param url    : url of the page
+        :param content: raw content of the page
+        :param status : http status code of the response
+
+        :return       : None
+
+        """
+
+        if self._writer is None or self._writer.tell() >= SEGMENT_SIZE:
+            self._open_segment()
+
+        data = zlib.compress(content, COMPRESSION_LEVEL)
+
+        offset = self._writer.tell()
+
+        self._writer.write(data)
+
+        # page must be on disk before index points to it
+        self._writer.flush()
+
+        # an error page of an url is kept only if there is no successful page
+        with self.index:
+            self.index.execute(
+                """
+                INSERT INTO pages (url, segment, offset, length, status, fetched_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    segment = excluded.segment, offset = excluded.offset, length = excluded.length,
+                    status = excluded.status, fetched_at = excluded.fetched_at
+                WHERE excluded.status BETWEEN 200 AND 299 OR pages.status NOT BETWEEN 200 AND 299
+                """,
+                (url, self._segment, offset, len(data), status, time.time())
+            )
+
+    def _map(self, segment: str, end: int) -> mmap.mmap:
+        """
+
+        Memory map of a segment covering at least end bytes.
+
+        Segments still being written grow, so the map is renewed when it is too short.
+
+        :param segment: name of the segment file
+        :param end    : last byte needed
+
+        :return       : memory map of the segment
+
+        """
+
+        segment_map = self._maps.get(segment)
+
+        if segment_map is None or len(segment_map) < end:
+
+            if segment_map is not None:
+                segment_map.close()
+
+            with open(os.path.join(self.path, segment), 'rb') as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self._maps[segment] = segment_map
+
+        return segment_map
+
+    def get(self, url: str) -> bytes:
+        """
+
+        Read a page from the archive.
+
+        :param url: url of the page
+
+        :return   : raw content of the page
+
+        :raises KeyError: if page is not in the archive
+
+        """
+
+        row = self.index.execute("SELECT segment, offset, length FROM pages WHERE url = ?", (url,)).fetchone()
+
+        if row is None:
+            raise KeyError(url)
+
+        segment, offset, length = row
+
+        return zlib.decompress(self._map(segment, offset + length)[offset:offset + length])
+
+    def status(self, url: str) -> int:
+        """
+
+        Http status code of an archived page.
+
+        :param url: url of the page
+
+        :return   : status code
+
+        :raises KeyError: if page is not in the archive
+
+        """
+
+        row = self.index.execute("SELECT status FROM pages WHERE url = ?", (url,)).fetchone()
+
+        if row is None:
+            raise KeyError(url)
+
+        return row[0]
+
+    def __contains__(self, url: str) -> bool:
+        return self.index.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.index.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def urls(self) -> list:
+        """
+
+        Urls in the archive, in the order of segments so pages are read sequentially.
+
+        :return: list of urls
+
+        """
+
+        return [url for (url,) in self.index.execute("SELECT url FROM pages ORDER BY segment, offset")]
+
+    def close(self) -> None:
+
+        if self._writer is not None:
+            self._writer.close()
+
+        for segment_map in self._maps.values():
+            segment_map.close()
+
+        self.index.close()
+
+
+# archive is opened on first fetch, so importing scrapers does not create files
+_archive : PageArchive = None
+
+
+def _get_archive() -> PageArchive:
+
+    global _archive
+
+    if _archive is None:
+        _archive = PageArchive()
+
+    return _archive
+
+
+def _raise_for_status(url: str, status: int, response: requests.Response = None) -> None:
+    """
+
+    Raise for status codes other than 2xx, in the same way for fetched and archived pages.
+
+    """
+
+    if not 200 <= status <= 299:
+        raise requests.HTTPError(f"{status} status for url: {url}", response=response)
+
+
+def fetch(url: str, timeout: float = None) -> bytes:
+    """
+
+    Fetch content of a page according to MODE.
+
+    :param url    : url of the page
+    :param timeout: request timeout in seconds
+
+    :return       : raw content of the page
+
+    :raises KeyError          : in replay mode if page is not in the archive
+    :raises requests.HTTPError: if status code of the page is not 2xx
+
+    """
+
+    if MODE == "replay":
+
+        archive = _get_archive()
+
+        _raise_for_status(url, archive.status(url))
+
+        return archive.get(url)
+
+    # request the page
+    page = requests.get(url, timeout=timeout)
+
+    # error pages are archived too, they do not replace successful pages
+    if MODE == "record":
+        _get_archive().put(url, page.content, page.status_code)
+
+    _raise_for_status(url, page.status_code, page)
+
+    return page.content
@@ -0,0 +1,606 @@
+"""
+Distributed scraping workers sharing a SQLite work queue.
+
+Program, university and city urls are enqueued once, then any number of
+workers (processes on one host, or hosts sharing the queue file) claim
+batches of urls as leases. Failed urls go back to the queue until they run
+out of attempts and results are written back in the same transaction that
+marks the urls as done. Merging the results writes the same .csv files the
+single process scrapers write.
+
+WAL journal needs shared memory and only works when all workers run on the
+same host. For workers on several hosts use `--journal-mode delete`. The
+journal mode is used for the page archive of the scrapers too.
+
+usage:
+
+    python scraping-worker.py enqueue programs
+    python scraping-worker.py work programs --batch-size 20
+    python scraping-worker.py status
+    python scraping-worker.py merge programs
+
+author: @firattamur
+"""
+
+
+import os
+import csv
+import time
+import json
+import socket
+import sqlite3
+import argparse
+import importlib.util
+
+
+# folder of the scrapers, they are loaded from file because of '-' in names
+SCRAPERS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# default queue file
+QUEUE_PATH = "../data-version2/raw/work-queue.sqlite"
+
+# kind of urls in queue and the scraper collecting them
+SCRAPERS = {
+
+    "programs"    : "master-programs-scraper",
+    "universities": "universities-image-scraper",
+    "cities"      : "cities-scraper",
+
+}
+
+# seconds a claimed batch belongs to a worker
+LEASE_SECONDS = 300
+
+# a url is marked as failed after this many attempts
+MAX_ATTEMPTS = 3
+
+# longest wait of a worker for urls leased to other workers
+POLL_SECONDS = 10
+
+SCHEMA = """
+
+CREATE TABLE IF NOT EXISTS tasks (
+
+    id            INTEGER PRIMARY KEY,
+    kind          TEXT    NOT NULL,
+    url           TEXT    NOT NULL,
+    payload       TEXT    NOT NULL,
+    state         TEXT    NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    error         TEXT,
+
+    UNIQUE (kind, url)
+);
+
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (kind, state, lease_expires);
+
+CREATE TABLE IF NOT EXISTS results (
+
+    task_id INTEGER PRIMARY KEY REFERENCES tasks (id),
+    row     TEXT    NOT NULL
+);
+
+"""
+
+
+def _load_scraper(kind: str):
+    """
+
+    Load scraper module for the kind of urls.
+
+    :param kind: programs, universities or cities
+
+    :return    : scraper module
+
+    """
+
+    name = SCRAPERS[kind]
+
+    spec   = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(SCRAPERS_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def connect(path: str, journal_mode: str = "wal") -> sqlite3.Connection:
+    """
+
+    Open the queue database and create tables if they do not exist.
+
+    :param path        : path of the queue file
+    :param journal_mode: sqlite journal mode, wal for single host
+
+    :return            : connection in autocommit mode, transactions are explicit
+
+    """
+
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+
+    connection.execute(f"PRAGMA journal_mode = {journal_mode}")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def enqueue(connection: sqlite3.Connection, kind: str, tasks: list) -> int:
+    """
+
+    Add urls to the queue. Urls already in the queue are skipped.
+
+    :param connection: queue connection
+    :param kind      : programs, universities or cities
+    :param tasks     : list of (url, payload) tuples, payload is json serializable
+
+    :return          : number of new urls
+
+    """
+
+    connection.execute("BEGIN IMMEDIATE")
+
+    try:
+
+        before = connection.total_changes
+
+        connection.executemany(
+            "INSERT OR IGNORE INTO tasks (kind, url, payload) VALUES (?, ?, ?)",
+            ((kind, url, json.dumps(payload)) for url, payload in tasks)
+        )
+
+        added = connection.total_changes - before
+
+        connection.execute("COMMIT")
+
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+    return added
+
+
+def claim(connection: sqlite3.Connection, kind: str, owner: str, batch_size: int,
+          lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS) -> list:
+    """
+
+    Claim a batch of pending urls or urls with an expired lease.
+
+    :param connection   : queue connection
+    :param kind         : programs, universities or cities
+    :param owner        : unique name of the worker
+    :param batch_size   : number of urls to claim
+    :param lease_seconds: seconds until claim expires
+    :param max_attempts : expired claims are marked as failed after this many attempts
+
+    :return             : list of (task id, url, payload) tuples
+
+    """
+
+    now = time.time()
+
+    # immediate transaction takes the write lock so two workers cannot claim the same urls
+    connection.execute("BEGIN IMMEDIATE")
+
+    try:
+
+        # lease expired after the last attempt, the worker died while scraping it
+        connection.execute(
+            """
+            UPDATE tasks SET state = 'failed', lease_owner = NULL, lease_expires = NULL,
+                             error = COALESCE(error, 'lease expired')
+            WHERE kind = ? AND state = 'claimed' AND lease_expires < ? AND attempts >= ?
+            """,
+            (kind, now, max_attempts)
+        )
+
+        rows = connection.execute(
+            """
+            SELECT id, url, payload FROM tasks
+            WHERE kind = ? AND (state = 'pending' OR (state = 'claimed' AND lease_expires < ? AND attempts < ?))
+            ORDER BY id LIMIT ?
+            """,
+            (kind, now, max_attempts, batch_size)
+        ).fetchall()
+
+        connection.executemany(
+            """
+            UPDATE tasks SET state = 'claimed', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE id = ?
+            """,
+            ((owner, now + lease_seconds, task_id) for task_id, _, _ in rows)
+        )
+
+        connection.execute("COMMIT")
+
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+    return [(task_id, url, json.loads(payload)) for task_id, url, payload in rows]
+
+
+def complete(connection: sqlite3.Connection, owner: str, done: list, failed: list, max_attempts: int = MAX_ATTEMPTS) -> int:
+    """
+
+    Write results of a batch and release failed urls in a single transaction.
+
+    Tasks whose lease expired and were claimed by another worker are left untouched.
+
+    :param connection  : queue connection
+    :param owner       : unique name of the worker
+    :param done        : list of (task id, row) tuples
+    :param failed      : list of (task id, error) tuples
+    :param max_attempts: attempts before a url is marked as failed
+
+    :return            : number of results accepted
+
+    """
+
+    accepted = 0
+
+    connection.execute("BEGIN IMMEDIATE")
+
+    try:
+
+        for task_id, row in done:
+
+            updated = connection.execute(
+                "UPDATE tasks SET state = 'done', lease_owner = NULL, lease_expires = NULL, error = NULL WHERE id = ? AND lease_owner = ? AND state = 'claimed'",
+                (task_id, owner)
+            ).rowcount
+
+            if updated:
+                connection.execute("INSERT OR REPLACE INTO results (task_id, row) VALUES (?, ?)", (task_id, json.dumps(row)))
+
+                accepted += 1
+
+        connection.executemany(
+            """
+            UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                             lease_owner = NULL, lease_expires = NULL, error = ?
+            WHERE id = ? AND lease_owner = ? AND state = 'claimed'
+            """,
+            ((max_attempts, error, task_id, owner) for task_id, error in failed)
+        )
+
+        connection.execute("COMMIT")
+
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+    return accepted
+
+
+def _next_lease_expiry(connection: sqlite3.Connection, kind: str) -> float:
+    """
+
+    Time the earliest lease of a kind expires, a claimed url of a crashed worker can be claimed again then.
+
+    :param connection: queue connection
+    :param kind      : programs, universities or cities
+
+    :return          : unix time, now if there are pending urls, None if there is nothing pending or claimed
+
+    """
+
+    pending, expires = connection.execute(
+        """
+        SELECT SUM(state = 'pending'), MIN(CASE WHEN state = 'claimed' THEN lease_expires END)
+        FROM tasks WHERE kind = ?
+        """,
+        (kind,)
+    ).fetchone()
+
+    if pending:
+        return time.time()
+
+    return expires
+
+
+def _scrape(scraper, kind: str, url: str, payload: dict) -> list:
+    """
+
+    Scrape a single url and return the .csv row for it.
+
+    :param scraper: scraper module for the kind
+    :param kind   : programs, universities or cities
+    :param url    : url to scrape
+    :param payload: extra values stored with url
+
+    :return       : row in the layout of the scraper .csv file
+
+    """
+
+    if kind == "programs":
+        return scraper._collect_single_program_details(url=url, field=payload["field"]).to_row()
+
+    if kind == "universities":
+
+        university, image_url = scraper._collect_single_university_image_url(url=url)
+
+        if image_url == "":
+            raise ValueError("no image url")
+
+        return [university, image_url]
+
+    indexes = scraper.collect_quality_indexes(url=url)
+
+    row = [payload["city"], payload["country"]]
+
+    # same order as CSV_COLUMNS of cities scraper
+    for column in scraper.CSV_COLUMNS[1::2]:
+        row.extend(indexes[column])
+
+    return row
+
+
+def work(connection: sqlite3.Connection, kind: str, batch_size: int, lease_seconds: float = LEASE_SECONDS, verbose: bool = False) -> int:
+    """
+
+    Claim and scrape batches until there is nothing pending or claimed in the queue.
+
+    Urls leased to other workers are waited for, if a worker crashed its urls
+    are claimed again when their lease expires.
+
+    :param connection   : queue connection
+    :param kind         : programs, universities or cities
+    :param batch_size   : number of urls to claim at once
+    :param lease_seconds: seconds until claim expires
+    :param verbose      : print details of batches
+
+    :return             : number of scraped urls
+
+    """
+
+    scraper = _load_scraper(kind)
+
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+
+    scraped = 0
+
+    while True:
+
+        tasks = claim(connection, kind, owner, batch_size, lease_seconds)
+
+        if not tasks:
+
+            expires = _next_lease_expiry(connection, kind)
+
+            if expires is None:
+                break
+
+            # other workers may release urls before their lease expires
+            wait = min(max(expires - time.time(), 0) + 1, POLL_SECONDS)
+
+            if verbose:
+                print(f"{owner} - Waiting {wait:.0f}s for urls leased to other workers")
+
+            time.sleep(wait)
+
+            continue
+
+        done   : list = []
+        failed : list = []
+
+        for task_id, url, payload in tasks:
+
+            try:
+                done.append((task_id, _scrape(scraper, kind, url, payload)))
+            except Exception as error:
+                failed.append((task_id, f"{type(error).__name__}: {error}"))
+
+        # results of urls whose lease was lost are dropped
+        accepted = complete(connection, owner, done, failed)
+
+        scraped += accepted
+
+        if verbose:
+            print(f"{owner} - Scraped: {accepted} Failed: {len(failed)} Lost lease: {len(done) - accepted} Total: {scraped}")
+
+    return scraped
+
+
+def status(connection: sqlite3.Connection) -> dict:
+    """
+
+    Count urls in each state for each kind.
+
+    :param connection: queue connection
+
+    :return          : dict of kind to dict of state and count
+
+    """
+
+    progress : dict[str, dict[str, int]] = {}
+
+    now = time.time()
+
+    rows = connection.execute(
+        """
+        SELECT kind, CASE WHEN state = 'claimed' AND lease_expires < ? THEN 'expired' ELSE state END, COUNT(*)
+        FROM tasks GROUP BY 1, 2
+        """,
+        (now,)
+    )
+
+    for kind, state, count in rows:
+        progress.setdefault(kind, {})[state] = count
+
+    return progress
+
+
+def merge(connection: sqlite3.Connection, kind: str, csv_name: str) -> int:
+    """
+
+    Write results of a kind into .csv file in the layout of its scraper.
+
+    Rows are written in the order urls were enqueued.
+
+    :param connection: queue connection
+    :param kind      : programs, universities or cities
+    :param csv_name  : name of .csv file
+
+    :return          : number of rows written
+
+    """
+
+    scraper = _load_scraper(kind)
+
+    if kind == "cities":
+        header, save_to = ["city"] + scraper.CSV_COLUMNS, f"{scraper.PATH}/{csv_name}.csv"
+    else:
+        header, save_to = scraper.CSV_COLUMNS, f"{scraper.PATH}{csv_name}.csv"
+
+    rows = connection.execute(
+        "SELECT results.row FROM results JOIN tasks ON tasks.id = results.task_id WHERE tasks.kind = ? ORDER BY tasks.id",
+        (kind,)
+    )
+
+    # universities scraper keeps one image url for each university
+    seen : set[str] = set()
+
+    count = 0
+
+    with open(save_to, 'w', encoding='UTF8', newline='') as f:
+        writer = csv.writer(f)
+
+        # write the header
+        writer.writerow(header)
+
+        for (row,) in rows:
+
+            row = json.loads(row)
+
+            if kind == "universities":
+
+                if row[0] in seen:
+                    continue
+
+                seen.add(row[0])
+
+            writer.writerow(row)
+
+            count += 1
+
+    return count
+
+
+def _tasks_to_enqueue(kind: str) -> list:
+    """
+
+    Collect urls to enqueue for a kind.
+
+    Programs and universities are read from the program urls .csv file,
+    cities are collected from the country pages.
+
+    :param kind: programs, universities or cities
+
+    :return    : list of (url, payload) tuples
+
+    """
+
+    scraper = _load_scraper(kind)
+
+    tasks : list = []
+
+    if kind == "cities":
+
+        countries = scraper.collect_country_urls(url=scraper.BASE_URL)
+
+        for country, country_url in countries.items():
+
+            try:
+                cities = scraper.collect_city_urls(url=country_url, name=country)
+            except:
+                continue
+
+            for city, city_url in cities.items():
+
+                name = city[:-2] if city.endswith("-2") else city
+
+                tasks.append((city_url, {"city": name, "country": country}))
+
+        return tasks
+
+    programs = _load_scraper("programs")
+
+    with open(f"{programs.PATH}master-programs-url.csv", 'r', encoding='UTF8', newline='') as f:
+
+        reader = csv.reader(f)
+
+        # skip the header
+        next(reader)
+
+        for field, url in reader:
+            tasks.append((url, {"field": field}))
+
+    return tasks
+
+
+def main():
+    """
+
+    Command line entry for enqueue, work, status and merge commands.
+
+    """
+
+    parser = argparse.ArgumentParser(description="Scrape with several workers sharing a SQLite queue.")
+
+    parser.add_argument("command", choices=["enqueue", "work", "status", "merge"])
+    parser.add_argument("kind", nargs="?", choices=list(SCRAPERS.keys()))
+    parser.add_argument("--queue", default=QUEUE_PATH, help="path of the queue file")
+    parser.add_argument("--journal-mode", default=os.environ.get("PAGE_ARCHIVE_JOURNAL_MODE", "wal"), help="use delete when workers run on several hosts")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--csv-name", help="name of merged .csv file")
+
+    args = parser.parse_args()
+
+    if args.command != "status" and args.kind is None:
+        parser.error(f"{args.command} needs kind of urls")
+
+    connection = connect(args.queue, journal_mode=args.journal_mode)
+
+    # page archive of the scrapers shares the file system with the queue
+    os.environ["PAGE_ARCHIVE_JOURNAL_MODE"] = args.journal_mode
+
+    if args.command == "enqueue":
+
+        added = enqueue(connection, args.kind, _tasks_to_enqueue(args.kind))
+
+        print(f"{args.kind} - Enqueued: {added}")
+
+    elif args.command == "work":
+
+        scraped = work(connection, args.kind, batch_size=args.batch_size, lease_seconds=args.lease_seconds, verbose=True)
+
+        print(f"{args.kind} - Scraped: {scraped}")
+
+    elif args.command == "status":
+
+        for kind, states in status(connection).items():
+            print(kind, " ".join(f"{state}: {count}" for state, count in sorted(states.items())))
+
+    else:
+
+        csv_names = {
+            "programs"    : "master-programs",
+            "universities": "universities-image-urls",
+            "cities"      : "city-quality-of-indexes",
+        }
+
+        merged = merge(connection, args.kind, args.csv_name or csv_names[args.kind])
+
+        print(f"{args.kind} - Merged: {merged}")
+
+    connection.close()
+
+
+if __name__ == "__main__":
+
+    # start worker or coordinator command
+    main()
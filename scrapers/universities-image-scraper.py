@@ -7,9 +7,9 @@ author: @firattamur
 
 import csv
 import json 
-import requests
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from page_archive import fetch
 
 
 # folder path
@@ -36,11 +36,11 @@ def _collect_single_university_image_url(url: str, verbose: bool = False) -> tup
     """
     image_url : str = ""
 
-    # request the page
-    page = requests.get(url, timeout=2)
+    # request the page or read it from archive
+    page = fetch(url, timeout=2)
 
     # parse page 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = BeautifulSoup(page, "html.parser")
 
     # get url from page
     data = soup.findAll('div', attrs={ 'class' : 'logo' })
@@ -0,0 +1,97 @@
+"""
+Checks for pipelines/build-serving-table.py.
+
+author: @firattamur
+"""
+
+
+import os
+import importlib.util
+
+import pandas as pd
+
+
+PIPELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipelines")
+
+
+def _load_pipeline(name: str):
+
+    spec   = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(PIPELINES_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+
+    spec.loader.exec_module(module)
+
+    return module
+
+
+build_serving_table = _load_pipeline("build-serving-table")
+
+
+def _write_final_tables(path: str, tution_amount: str, city_name: str = "Rome") -> None:
+    """
+
+    Write small final tables, one program has no university.
+
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    # only cost of living index is known, other indexes are empty
+    cities = pd.DataFrame(columns=["id"] + list(build_serving_table.CITY_COLUMNS.keys()))
+
+    cities.loc[0, ["id", "name", "country", "cost_of_living_index"]] = [0, city_name, "Italy", "70.1"]
+    cities.loc[1, ["id", "name", "country"]] = [1, "Paris", "France"]
+
+    cities.to_csv(f"{path}cities.csv", index=False)
+
+    pd.DataFrame(
+        [[0, "Rome Business School", "", "0.0", "12"], [1, "Il Groupe", "", "1.0", ""]],
+        columns=["id", "name", "image", "cityId", "rank"]
+    ).to_csv(f"{path}universities.csv", index=False)
+
+    pd.DataFrame(
+        [[0, "Master In Management", "CAMPUS", "0", "12", tution_amount, "EUR"],
+         [1, "Master In Finance", "ONLINE", "1", "24", "9000", "EUR"],
+         [2, "Master In Law", "CAMPUS", "", "", "", ""]],
+        columns=["id", "name", "mode", "university_id", "duration", "tution_amount", "tution_currency"]
+    ).to_csv(f"{path}masters.csv", index=False)
+
+
+def test_decimal_tuition_is_kept(tmp_path):
+
+    final_path   = f"{tmp_path}/final/"
+    serving_path = f"{tmp_path}/serving/"
+
+    _write_final_tables(final_path, "100.5")
+
+    build_serving_table.build_serving_table(final_path, serving_path, verbose=False)
+
+    serving = build_serving_table.load_serving_table(serving_path)
+
+    assert serving.loc[0, "tution_amount"] == 100.5
+    assert serving.loc[1, "tution_amount"] == 9000
+    assert pd.isna(serving.loc[2, "university_name"])
+
+
+def test_refresh_equals_full_build(tmp_path):
+
+    final_path   = f"{tmp_path}/final/"
+    serving_path = f"{tmp_path}/serving/"
+    full_path    = f"{tmp_path}/full/"
+
+    _write_final_tables(final_path, "9000")
+
+    build_serving_table.build_serving_table(final_path, serving_path, verbose=False)
+
+    # a program gets a decimal tuition and a city is renamed
+    _write_final_tables(final_path, "100.5", city_name="Roma")
+
+    build_serving_table.build_serving_table(final_path, serving_path, verbose=False)
+    build_serving_table.build_serving_table(final_path, full_path, verbose=False)
+
+    refreshed = build_serving_table.load_serving_table(serving_path)
+
+    pd.testing.assert_frame_equal(refreshed, build_serving_table.load_serving_table(full_path))
+
+    assert refreshed.loc[0, "city_name"] == "Roma"
+    assert refreshed.loc[0, "tution_amount"] == 100.5
@@ -0,0 +1,207 @@
+"""
+Regression checks for pipelines/sync-database.py.
+
+author: @firattamur
+"""
+
+
+import os
+import importlib.util
+
+import pytest
+import pandas as pd
+
+
+PIPELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipelines")
+
+
+def _load_pipeline(name: str):
+
+    spec   = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(PIPELINES_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+
+    spec.loader.exec_module(module)
+
+    return module
+
+
+sync_database = _load_pipeline("sync-database")
+
+
+CITIES = [
+
+    ["Rome", "Italy", "70.1"],
+    ["Paris", "France", "80.2"],
+    ["Berlin", "Germany", "75.3"],
+
+]
+
+# name, city
+UNIVERSITIES = [
+
+    ["Rome Business School", "Rome"],
+    ["Il Groupe", "Paris"],
+    ["Berlin School", "Berlin"],
+    ["Closed University", "Berlin"],
+
+]
+
+# name, university, schedule
+MASTERS = [
+
+    ["Master In Management", "Rome Business School", "FULLTIME"],
+    ["Master In Management", "Rome Business School", "PARTTIME"],
+    ["Master In Finance", "Il Groupe", "FULLTIME"],
+    ["Master In Design", "Berlin School", "FULLTIME"],
+    ["Master In Law", "Closed University", "FULLTIME"],
+
+]
+
+
+def _write_final_tables(path: str, cities: list, universities: list, masters: list) -> None:
+    """
+
+    Write final tables with positional ids like the cleaning notebooks do.
+
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    city_ids = {name: index for index, (name, _, _) in enumerate(cities)}
+
+    pd.DataFrame(
+        [[index, name, country, index_value] for index, (name, country, index_value) in enumerate(cities)],
+        columns=["id", "name", "country", "cost_of_living_index"]
+    ).to_csv(f"{path}cities.csv", index=False)
+
+    university_ids = {name: index for index, (name, _) in enumerate(universities)}
+
+    pd.DataFrame(
+        [[index, name, f"{float(city_ids[city])}"] for index, (name, city) in enumerate(universities)],
+        columns=["id", "name", "cityId"]
+    ).to_csv(f"{path}universities.csv", index=False)
+
+    pd.DataFrame(
+        [[index, name, "CAMPUS", schedule, "English", "BUSINESS", university_ids[university]]
+         for index, (name, university, schedule) in enumerate(masters)],
+        columns=["id", "name", "mode", "schedule", "language", "field", "university_id"]
+    ).to_csv(f"{path}masters.csv", index=False)
+
+
+def _joined(snapshot_path: str) -> set:
+    """
+
+    Programs with the names of their university and city, as stored in snapshot.
+
+    """
+
+    cities       = pd.read_csv(f"{snapshot_path}cities.csv").set_index("id")
+    universities = pd.read_csv(f"{snapshot_path}universities.csv").set_index("id")
+    masters      = pd.read_csv(f"{snapshot_path}masters.csv")
+
+    university = masters["university_id"].map(universities["name"])
+    city       = masters["university_id"].map(universities["cityId"]).map(cities["name"])
+
+    return set(zip(masters["id"], masters["name"], masters["schedule"], university, city))
+
+
+def test_reordered_rows_keep_ids_and_foreign_keys(tmp_path):
+
+    final_path    = f"{tmp_path}/final/"
+    snapshot_path = f"{tmp_path}/synced/"
+
+    os.makedirs(snapshot_path)
+
+    _write_final_tables(final_path, CITIES, UNIVERSITIES, MASTERS)
+
+    sync_database.bootstrap(path=final_path, snapshot_path=snapshot_path)
+
+    before = _joined(snapshot_path)
+
+    # refresh reorders every table and removes a university with its programs
+    _write_final_tables(
+        final_path,
+        CITIES[::-1],
+        [university for university in UNIVERSITIES[::-1] if university[0] != "Closed University"],
+        [master for master in MASTERS[::-1] if master[1] != "Closed University"],
+    )
+
+    statements = sync_database.sync(path=final_path, snapshot_path=snapshot_path, verbose=False)
+
+    after = _joined(snapshot_path)
+
+    # same ids point to the same university and city
+    assert after == {row for row in before if row[3] != "Closed University"}
+
+    # only the removed rows are deleted, nothing else changes
+    assert [statement for statement in statements if not statement.startswith("DELETE")] == []
+    assert len([statement for statement in statements if statement.startswith("DELETE")]) == 2
+
+
+def test_changed_rows_are_updated_in_batches(tmp_path):
+
+    final_path    = f"{tmp_path}/final/"
+    snapshot_path = f"{tmp_path}/synced/"
+
+    os.makedirs(snapshot_path)
+
+    _write_final_tables(final_path, CITIES, UNIVERSITIES, MASTERS)
+
+    sync_database.bootstrap(path=final_path, snapshot_path=snapshot_path)
+
+    # every city changes its index, a new university and program are added
+    cities       = [[name, country, "99.9"] for name, country, _ in CITIES]
+    universities = UNIVERSITIES + [["New University", "Rome"]]
+    masters      = MASTERS + [["Master In Art", "New University", "FULLTIME"]]
+
+    _write_final_tables(final_path, cities, universities, masters)
+
+    statements = sync_database.sync(path=final_path, snapshot_path=snapshot_path, verbose=False)
+
+    updates = [statement for statement in statements if statement.startswith("UPDATE")]
+
+    assert len(updates) == 1
+    assert updates[0].startswith('UPDATE "cities"')
+
+    assert 'INSERT INTO "universities" ("id", "name", "cityId") VALUES\n(\'4\', \'New University\', \'0\');' in statements
+    assert 'INSERT INTO "masters"' in "\n".join(statements)
+
+
+def test_sync_without_snapshot_or_database_fails(tmp_path):
+
+    final_path = f"{tmp_path}/final/"
+
+    _write_final_tables(final_path, CITIES, UNIVERSITIES, MASTERS)
+
+    # without a snapshot every row would be inserted into a loaded database
+    with pytest.raises(FileNotFoundError):
+        sync_database.sync(path=final_path, snapshot_path=f"{tmp_path}/synced/", verbose=False)
+
+
+def test_columns_of_later_stages_are_added_first(tmp_path):
+
+    final_path    = f"{tmp_path}/final/"
+    snapshot_path = f"{tmp_path}/synced/"
+
+    os.makedirs(snapshot_path)
+
+    _write_final_tables(final_path, CITIES, UNIVERSITIES, MASTERS)
+
+    sync_database.bootstrap(path=final_path, snapshot_path=snapshot_path)
+
+    # normalize-tuition adds its columns to masters after the database was loaded
+    masters = pd.read_csv(f"{final_path}masters.csv")
+
+    masters["tution_amount_usd"]    = 10000
+    masters["annual_tution_usd"]    = 5000
+    masters["tution_rates_version"] = "2022-01"
+
+    masters.to_csv(f"{final_path}masters.csv", index=False)
+
+    statements = sync_database.sync(path=final_path, snapshot_path=snapshot_path, verbose=False)
+
+    schema = sync_database._load_stage("normalize-tuition").INDEX_STATEMENTS
+
+    # columns exist before the temporary table copies masters
+    assert statements[:len(schema)] == schema
+    assert [statement for statement in statements if statement.startswith("UPDATE")][0].startswith('UPDATE "masters"')